@@ -1,13 +1,28 @@
 import os
 import sys
+import contextlib
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import matplotlib
+matplotlib.use("Agg", force=True)  # Plots are only saved to file, so skip GUI backend setup
+matplotlib.rcParams['path.simplify_threshold'] = 1.0  # Drop vertices that would not change the rendered line
+matplotlib.rcParams['agg.path.chunksize'] = 10000     # Render long speed series in chunks
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import subprocess
-import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
 import math
+import time
+import re
 import logging
+import hashlib
+import pickle
+import numpy as np
 import pandas as pd  # Add this import
 from datetime import datetime, timedelta  # Add this import
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 # Try to import pyproj for coordinate conversion
 try:
@@ -17,13 +32,59 @@ except ImportError:
     HAS_PYPROJ = False
     print("Warning: pyproj not installed. Install with 'pip install pyproj' for better coordinate accuracy")
 
+# Prefer lxml's C parser/serializer for route and config XML, fall back to the stdlib
+try:
+    from lxml import etree as ET
+    HAS_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAS_LXML = False
+
+# Persist API responses between runs when diskcache is available
+try:
+    from diskcache import Cache
+    HAS_DISKCACHE = True
+except ImportError:
+    HAS_DISKCACHE = False
+
+# Use a KD-tree spatial index for neighbour searches when scipy is available
+try:
+    from scipy.spatial import cKDTree
+    HAS_SCIPY = True
+except ImportError:
+    HAS_SCIPY = False
+
+# Compile numeric kernels with numba when available, otherwise run them as plain Python
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+    def njit(*args, **kwargs):
+        """No-op replacement for numba.njit"""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# XML Schema instance namespace used by SUMO's xsd references
+XSI_NAMESPACE = "http://www.w3.org/2001/XMLSchema-instance"
+ET.register_namespace("xsi", XSI_NAMESPACE)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Progress messages from the simulation run, written to stdout as plain lines without the root formatter
+SIM_LOGGER = logging.getLogger("sumo_sim")
+SIM_LOGGER.propagate = False
+SIM_LOGGER.addHandler(logging.StreamHandler(sys.stdout))
+
 # Add a verbose flag for detailed output
 VERBOSE = False  # Set to True for detailed output
 
+# Run the main simulation in sumo-gui (socket TraCI) or headless in-process via libsumo
+USE_GUI = True  # Set to False for faster headless runs
+
 if 'SUMO_HOME' in os.environ:
     tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
     sys.path.append(tools)
@@ -31,7 +92,14 @@ if 'SUMO_HOME' in os.environ:
 else:
     sys.exit("please declare environment variable 'SUMO_HOME'")
 
-import traci
+# libsumo embeds SUMO in this process with the same API as traci, but cannot drive the GUI
+if USE_GUI:
+    import traci
+else:
+    try:
+        import libsumo as traci
+    except ImportError:
+        import traci
 
 def confirm_traci_connection():
     """Confirming TraCI connection"""
@@ -51,20 +119,93 @@ NET_FILE = "wolfsburg.net.xml"
 EDGE_WEIGHT_FILE = "edge_weights.xml"
 HEAVY_PENALTY = 100000
 
-SUMO_CMD = ["sumo-gui", "-c", SUMO_CONFIG_FILE, "--step-length", "1", "--end", "3600", 
+SIMULATION_END = 3600  # Simulation horizon in seconds
+PLOT_DOWNSAMPLE = 10   # Plot every Nth recorded sample
+
+SUMO_BINARY = "sumo-gui" if USE_GUI else "sumo"
+
+SUMO_CMD = [SUMO_BINARY, "-c", SUMO_CONFIG_FILE, "--step-length", "1", "--end", str(SIMULATION_END), 
             "--no-warnings", "--no-step-log"]
 
+# WMO weather code -> (description, road friction coefficient)
+WEATHER_CODE_MAP = {
+    0: ("Clear sky", 1.0),
+    1: ("Mainly clear", 0.95),
+    2: ("Partly cloudy", 0.9),
+    3: ("Overcast", 0.85),
+    45: ("Fog", 0.8),
+    48: ("Dense fog", 0.65),
+    51: ("Light drizzle", 0.75),
+    53: ("Moderate drizzle", 0.7),
+    55: ("Dense drizzle", 0.65),
+    61: ("Light rain", 0.7),
+    63: ("Moderate rain", 0.6),
+    65: ("Heavy rain", 0.5),
+    71: ("Light snow", 0.55),
+    73: ("Moderate snow", 0.45),
+    75: ("Heavy snow", 0.35),
+    77: ("Snow grains", 0.5),
+    80: ("Light rain showers", 0.65),
+    81: ("Moderate rain showers", 0.55),
+    82: ("Violent rain showers", 0.4),
+    85: ("Light snow showers", 0.5),
+    86: ("Heavy snow showers", 0.3),
+    95: ("Thunderstorm", 0.45),
+    96: ("Thunderstorm with hail", 0.35),
+    99: ("Thunderstorm with heavy hail", 0.25),
+}
+
+# Incident title keywords for severity classification
+HIGH_SEVERITY_PATTERN = re.compile(r"gesperrt|vollsperrung|blocked|closed", re.IGNORECASE)
+MEDIUM_SEVERITY_PATTERN = re.compile(r"baustelle|construction|roadwork|lane", re.IGNORECASE)
+
 # Cache for edge centers to avoid repeated calculations
 EDGE_CENTERS_CACHE = None
+EDGE_CENTERS_CACHE_FILE = ".edge_centers_{}.pkl"  # Formatted with the SHA-1 of NET_FILE
+EDGE_INDEX_CACHE = None  # (centers dict, arrays and KD-tree built from it) for get_affected_route_edges
 
-def add_vehicle_type_with_friction_device():
-    if VERBOSE:
-        print("Adding vehicle type with SUMO friction device to route file...")
-    tree = ET.parse(ROUTED_ROUTE_FILE)
-    root = tree.getroot()
-    existing_vtype = root.find('vType[@id="default"]')
-    if existing_vtype is not None:
-        root.remove(existing_vtype)
+# Hash of the affected-edge set the routed file was last computed for
+LAST_AFFECTED_HASH = None
+
+# Friction currently set on each edge in the running simulation
+APPLIED_EDGE_FRICTION = {}
+
+# Routes parsed from ROUTED_ROUTE_FILE, keyed by the file's (mtime, size) when read
+ROUTES_CACHE = None
+ROUTES_CACHE_STAMP = None
+
+# On-disk cache for weather and incident API responses
+API_CACHE_DIR = ".sumo_api_cache"
+API_CACHE = Cache(API_CACHE_DIR) if HAS_DISKCACHE else None
+WEATHER_CACHE_TTL = 900   # Weather responses are reused for 15 minutes
+INCIDENT_CACHE_TTL = 300  # Incident responses are reused for 5 minutes
+INCIDENT_PREFETCH_LEAD = 60  # Simulation seconds before an incident check to start fetching in the background
+
+# Shared HTTP session so API calls reuse TCP/TLS connections and one retry policy
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4, pool_maxsize=8,
+    # No connect retries, so an unreachable API still fails fast; only read errors and gateway statuses retry
+    max_retries=Retry(total=3, connect=0, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+))
+
+def get_json_cached(url, ttl, timeout=10, session=None):
+    """GET a JSON API response, reusing a cached copy from the same time bucket"""
+    # Key by URL and a coarse time bucket so all calls within one TTL window share a response
+    key = (url, int(datetime.now().timestamp() // ttl))
+    if API_CACHE is not None:
+        cached = API_CACHE.get(key)
+        if cached is not None:
+            return cached
+    r = (session or HTTP_SESSION).get(url, timeout=timeout)
+    r.raise_for_status()
+    data = r.json()
+    if API_CACHE is not None:
+        API_CACHE.set(key, data, expire=ttl)
+    return data
+
+def build_default_vtype():
+    """Default vehicle type carrying SUMO's friction device"""
     vtype = ET.Element('vType')
     vtype.set('id', 'default')
     vtype.set('accel', '2.6')
@@ -85,14 +226,62 @@ def add_vehicle_type_with_friction_device():
     p3 = ET.SubElement(vtype, 'param')
     p3.set('key', 'device.friction.offset')
     p3.set('value', '0.0')
-    root.insert(0, vtype)
-    for veh in root.findall('vehicle'):
-        veh.set('type', 'default')
-        if veh.find("param[@key='has.friction.device']") is None:
-            param = ET.SubElement(veh, 'param')
-            param.set('key', 'has.friction.device')
-            param.set('value', 'true')
-    tree.write(ROUTED_ROUTE_FILE, encoding='utf-8', xml_declaration=True)
+    return vtype
+
+def mark_vehicle_with_friction_device(veh):
+    """Assign the default vehicle type and friction device to a vehicle element"""
+    veh.set('type', 'default')
+    if veh.find("param[@key='has.friction.device']") is None:
+        param = ET.SubElement(veh, 'param')
+        param.set('key', 'has.friction.device')
+        param.set('value', 'true')
+
+def stream_vehicle_type_with_friction_device():
+    """Rewrite the routed file in a single streaming pass, holding one top-level element at a time"""
+    tmp_file = ROUTED_ROUTE_FILE + ".tmp"
+    with ET.xmlfile(tmp_file, encoding='utf-8') as xf, contextlib.ExitStack() as root_scope:
+        xf.write_declaration()
+        depth = 0
+        for event, elem in ET.iterparse(ROUTED_ROUTE_FILE, events=('start', 'end', 'comment')):
+            if event == 'start':
+                if depth == 0:
+                    # Open the root with its original attributes, then put the vehicle type first
+                    root_scope.enter_context(xf.element(elem.tag, dict(elem.attrib), nsmap=elem.nsmap))
+                    xf.write(build_default_vtype())
+                depth += 1
+            elif event == 'end':
+                depth -= 1
+                if depth == 1:
+                    # Detach from the parsed root first so lxml does not redeclare the root's namespaces on it
+                    elem.getparent().remove(elem)
+                    # The existing default vehicle type is replaced by the one written above
+                    if not (elem.tag == 'vType' and elem.get('id') == 'default'):
+                        if elem.tag == 'vehicle':
+                            mark_vehicle_with_friction_device(elem)
+                        xf.write(elem)
+                    elem.clear()
+            elif depth <= 1:
+                # Comments before the root or directly inside it
+                if elem.getparent() is not None:
+                    elem.getparent().remove(elem)
+                xf.write(elem)
+    os.replace(tmp_file, ROUTED_ROUTE_FILE)
+
+def add_vehicle_type_with_friction_device():
+    if VERBOSE:
+        print("Adding vehicle type with SUMO friction device to route file...")
+    if HAS_LXML:
+        stream_vehicle_type_with_friction_device()
+    else:
+        tree = ET.parse(ROUTED_ROUTE_FILE)
+        root = tree.getroot()
+        existing_vtype = root.find('vType[@id="default"]')
+        if existing_vtype is not None:
+            root.remove(existing_vtype)
+        root.insert(0, build_default_vtype())
+        for veh in root.findall('vehicle'):
+            mark_vehicle_with_friction_device(veh)
+        tree.write(ROUTED_ROUTE_FILE, encoding='utf-8', xml_declaration=True)
     if VERBOSE:
         print("Done.")
 
@@ -133,8 +322,7 @@ def generate_fallback_routes():
     import random
     random.seed(42)
     root = ET.Element("routes")
-    root.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
-    root.set("xsi:noNamespaceSchemaLocation", "http://sumo.dlr.de/xsd/routes_file.xsd")
+    root.set(f"{{{XSI_NAMESPACE}}}noNamespaceSchemaLocation", "http://sumo.dlr.de/xsd/routes_file.xsd")
     fallback = [
         {"from": "-25009994#6", "to": "1164243934#1"},
         {"from": "25009994#6", "to": "-1164243940#0"},
@@ -154,6 +342,7 @@ def generate_fallback_routes():
 
 def preprocess_routes_with_duarouter():
     """Step 1: Basic route preprocessing without incidents"""
+    global LAST_AFFECTED_HASH
     print("Preprocessing routes with duarouter...")
     duarouter_exe = os.path.join(sumo_bin_path, "duarouter")
     cmd = [
@@ -166,27 +355,61 @@ def preprocess_routes_with_duarouter():
     ]
     subprocess.run(cmd, check=True, capture_output=True, text=True)
     add_vehicle_type_with_friction_device()
+    LAST_AFFECTED_HASH = None  # Routed file no longer reflects any incident penalties
+    invalidate_routes_cache()
     print("Initial route preprocessing completed")
 
+def release_element(elem):
+    """Free a fully parsed element during iterparse so memory stays bounded"""
+    elem.clear()
+    if HAS_LXML:
+        # Drop already processed siblings still referenced by the root
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
 def get_routes_from_file():
-    """Extract the actual routes from the routed file"""
+    """Extract the actual routes from the routed file, reusing the last parse while the file is unchanged"""
+    global ROUTES_CACHE, ROUTES_CACHE_STAMP
+    try:
+        st = os.stat(ROUTED_ROUTE_FILE)
+        stamp = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        stamp = None
+    if stamp is not None and ROUTES_CACHE is not None and stamp == ROUTES_CACHE_STAMP:
+        return ROUTES_CACHE
+    
     routes = {}
     try:
-        tree = ET.parse(ROUTED_ROUTE_FILE)
-        root = tree.getroot()
-        
-        for vehicle in root.findall('vehicle'):
+        # Stream the file so only one vehicle element is held in memory at a time;
+        # lxml can filter by tag in C so other elements never reach Python
+        if HAS_LXML:
+            events = ET.iterparse(ROUTED_ROUTE_FILE, events=('end',), tag='vehicle')
+        else:
+            events = ET.iterparse(ROUTED_ROUTE_FILE, events=('end',))
+        for event, vehicle in events:
+            if vehicle.tag != 'vehicle':
+                continue
             vehicle_id = vehicle.get('id')
             route_elem = vehicle.find('route')
             if route_elem is not None:
                 edges = route_elem.get('edges', '').split()
                 routes[vehicle_id] = edges
+            release_element(vehicle)
     except Exception as e:
         if VERBOSE:
             print(f"Error reading routes: {e}")
+        return routes
     
+    ROUTES_CACHE = routes
+    ROUTES_CACHE_STAMP = stamp
     return routes
 
+def invalidate_routes_cache():
+    """Forget the parsed routes after the routed file has been rewritten"""
+    global ROUTES_CACHE, ROUTES_CACHE_STAMP
+    ROUTES_CACHE = None
+    ROUTES_CACHE_STAMP = None
+
 def update_sumocfg_to_use_routed_file():
     tree = ET.parse(SUMO_CONFIG_FILE)
     root = tree.getroot()
@@ -200,37 +423,9 @@ def get_diverse_friction_from_weather(verbose=None):
     try:
         lat, lon = 52.42, 10.78
         url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true"
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
-        data = r.json()
+        data = get_json_cached(url, WEATHER_CACHE_TTL)
         code = data.get("current_weather", {}).get("weathercode", 0)
-        map_ = {
-            0: ("Clear sky", 1.0),
-            1: ("Mainly clear", 0.95),
-            2: ("Partly cloudy", 0.9),
-            3: ("Overcast", 0.85),
-            45: ("Fog", 0.8),
-            48: ("Dense fog", 0.65),
-            51: ("Light drizzle", 0.75),
-            53: ("Moderate drizzle", 0.7),
-            55: ("Dense drizzle", 0.65),
-            61: ("Light rain", 0.7),
-            63: ("Moderate rain", 0.6),
-            65: ("Heavy rain", 0.5),
-            71: ("Light snow", 0.55),
-            73: ("Moderate snow", 0.45),
-            75: ("Heavy snow", 0.35),
-            77: ("Snow grains", 0.5),
-            80: ("Light rain showers", 0.65),
-            81: ("Moderate rain showers", 0.55),
-            82: ("Violent rain showers", 0.4),
-            85: ("Light snow showers", 0.5),
-            86: ("Heavy snow showers", 0.3),
-            95: ("Thunderstorm", 0.45),
-            96: ("Thunderstorm with hail", 0.35),
-            99: ("Thunderstorm with heavy hail", 0.25),
-        }
-        name, friction = map_.get(code, ("Unknown", 1.0))
+        name, friction = WEATHER_CODE_MAP.get(code, ("Unknown", 1.0))
         if verbose:
             print(f"Weather code {code}: {name}, friction {friction}")
         # Remove automatic printing when not verbose - let caller decide when to print
@@ -254,9 +449,7 @@ def fetch_minute_level_forecast(lat=52.42, lon=10.78, hours_ahead=3):
         url = (f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}"
                f"&minutely_15=weathercode&forecast_hours={hours_ahead}&timezone=Europe/Berlin")
         
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
-        data = r.json()
+        data = get_json_cached(url, WEATHER_CACHE_TTL)
         
         # Create DataFrame with minute-level precision
         df = pd.DataFrame({
@@ -285,57 +478,46 @@ def fetch_minute_level_forecast(lat=52.42, lon=10.78, hours_ahead=3):
             "weathercode": [0] * len(forecast_times)  # Clear weather as fallback
         })
 
+def get_forecast_lookup(forecast_df):
+    """Forecast times (int64 nanoseconds) and weather codes as arrays for searchsorted lookups"""
+    times_ns = forecast_df['time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    codes = forecast_df['weathercode'].to_numpy()
+    return times_ns, codes
+
+def find_forecast_rows(times_ns, real_times_ns):
+    """Index of the most recent forecast point that's not in the future for each query time,
+    or the first point if there are no past forecasts"""
+    return np.maximum(np.searchsorted(times_ns, real_times_ns, side='right') - 1, 0)
+
 def get_weather_for_simulation_time(forecast_df, sim_start_dt, sim_seconds):
     """Get weather forecast for exact simulation time using existing friction mapping"""
+    times_ns, codes = get_forecast_lookup(forecast_df)
+    
     # Calculate real-world time corresponding to simulation time
     real_time_now = sim_start_dt + timedelta(seconds=sim_seconds)
+    real_time_ns = np.datetime64(real_time_now, 'ns').view(np.int64)
     
-    # Find the most recent forecast point that's not in the future
-    valid_forecasts = forecast_df[forecast_df['time'] <= real_time_now]
+    weather_code = codes[int(find_forecast_rows(times_ns, real_time_ns))].item()
     
-    if valid_forecasts.empty:
-        # If no past forecasts, use the first available
-        weather_row = forecast_df.iloc[0]
-    else:
-        # Use the most recent forecast
-        weather_row = valid_forecasts.iloc[-1]
-    
-    weather_code = weather_row['weathercode']
-
-    #using the existing friction method
-    map_ = {
-        0: ("Clear sky", 1.0),
-        1: ("Mainly clear", 0.95),
-        2: ("Partly cloudy", 0.9),
-        3: ("Overcast", 0.85),
-        45: ("Fog", 0.8),
-        48: ("Dense fog", 0.65),
-        51: ("Light drizzle", 0.75),
-        53: ("Moderate drizzle", 0.7),
-        55: ("Dense drizzle", 0.65),
-        61: ("Light rain", 0.7),
-        63: ("Moderate rain", 0.6),
-        65: ("Heavy rain", 0.5),
-        71: ("Light snow", 0.55),
-        73: ("Moderate snow", 0.45),
-        75: ("Heavy snow", 0.35),
-        77: ("Snow grains", 0.5),
-        80: ("Light rain showers", 0.65),
-        81: ("Moderate rain showers", 0.55),
-        82: ("Violent rain showers", 0.4),
-        85: ("Light snow showers", 0.5),
-        86: ("Heavy snow showers", 0.3),
-        95: ("Thunderstorm", 0.45),
-        96: ("Thunderstorm with hail", 0.35),
-        99: ("Thunderstorm with heavy hail", 0.25),
-    }
-    
-    weather_name, friction_value = map_.get(weather_code, ("Unknown", 1.0))
+    weather_name, friction_value = WEATHER_CODE_MAP.get(weather_code, ("Unknown", 1.0))
     
     return str(friction_value), weather_code, weather_name
 
+def build_weather_schedule(forecast_df, sim_start_dt, duration=SIMULATION_END):
+    """Precompute which forecast point applies to every simulation second"""
+    times_ns, codes = get_forecast_lookup(forecast_df)
+    start_ns = np.datetime64(sim_start_dt, 'ns').view(np.int64)
+    row_by_second = find_forecast_rows(times_ns, start_ns + np.arange(duration + 1, dtype=np.int64) * 1_000_000_000)
+    
+    weather_by_row = []
+    for weather_code in forecast_df['weathercode']:
+        weather_name, friction_value = WEATHER_CODE_MAP.get(weather_code, ("Unknown", 1.0))
+        weather_by_row.append((str(friction_value), weather_code, weather_name))
+    
+    return row_by_second, weather_by_row
+
 def test_low_friction_scenario():
-    print("TEST MODE: Applying low friction 0.25 for heavy snow/thunderstorm test")
+    SIM_LOGGER.info("TEST MODE: Applying low friction 0.25 for heavy snow/thunderstorm test")
     return "0.25", 0, "TEST: Heavy Thunderstorm with Hail"
 
 def get_friction_settings():
@@ -354,27 +536,44 @@ def set_route_friction(routes, friction):
     for vehicle_id, route_edges in routes.items():
         affected_edges.update(route_edges)
     
-    # Apply friction only to route edges
+    # Apply friction only to route edges, skipping the TraCI round-trip for
+    # edges that already carry this friction value
     count = 0
+    set_friction = traci.edge.setFriction
     for edge in affected_edges:
+        if APPLIED_EDGE_FRICTION.get(edge) == f:
+            count += 1
+            continue
         try:
-            traci.edge.setFriction(edge, f)
+            set_friction(edge, f)
+            APPLIED_EDGE_FRICTION[edge] = f
             count += 1
         except:
             continue
     
     if VERBOSE:
-        print(f"Applied friction {f} to {count} route edges")
+        SIM_LOGGER.info("Applied friction %s to %d route edges", f, count)
     else:
-        print(f"Applied friction {f} to {count:,} route segments")
+        SIM_LOGGER.info("Applied friction %s to %s route segments", f, format(count, ","))
 
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # km
+@njit(cache=True, fastmath=True)
+def haversine_term(lat1, lon1, lat2, lon2):
+    """Haversine of the central angle, grows with distance so it can be compared without sqrt/atan2"""
     dlat = math.radians(lat2-lat1)
     dlon = math.radians(lon2-lon1)
-    a = (math.sin(dlat/2))**2 + math.cos(math.radians(lat1))*math.cos(math.radians(lat2))* (math.sin(dlon/2))**2
-    c = 2*math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R*c
+    return (math.sin(dlat/2))**2 + math.cos(math.radians(lat1))*math.cos(math.radians(lat2))* (math.sin(dlon/2))**2
+
+def haversine_term_array(lat1, lon1, lat2, lon2):
+    """Vectorized haversine_term for NumPy array inputs"""
+    dlat = np.radians(lat2-lat1)
+    dlon = np.radians(lon2-lon1)
+    return np.sin(dlat/2)**2 + np.cos(np.radians(lat1))*np.cos(np.radians(lat2))*np.sin(dlon/2)**2
+
+@njit(cache=True)
+def haversine_threshold(distance_km):
+    """haversine_term value at the given distance, for comparing against instead of the distance"""
+    R = 6371  # km
+    return math.sin(distance_km / (2*R))**2
 
 def create_coordinate_transformer():
     """Create transformer for GPS to local coordinate conversion"""
@@ -398,6 +597,19 @@ def convert_gps_to_local(lat, lon, transformer):
     except:
         return None, None
 
+def convert_gps_batch_to_local(lats, lons, transformer):
+    """Convert arrays of GPS coordinates to local network coordinates in one call"""
+    if not transformer or len(lats) == 0:
+        return None, None
+    try:
+        xs, ys = transformer.transform(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+        return np.asarray(xs), np.asarray(ys)
+    except:
+        return None, None
+
+# Shared GPS -> UTM transformer, built once instead of on every incident fetch
+COORDINATE_TRANSFORMER = create_coordinate_transformer()
+
 def get_network_bounds():
     """Get the bounds of the network for filtering incidents"""
     try:
@@ -409,44 +621,194 @@ def get_network_bounds():
 
 def get_incident_severity(incident_data):
     """Determine incident severity for different penalty weights"""
-    title = incident_data.get("title", "").lower()
+    title = incident_data.get("title", "")
     
     # High severity
-    if any(word in title for word in ["gesperrt", "vollsperrung", "blocked", "closed"]):
+    if HIGH_SEVERITY_PATTERN.search(title):
         return "high"
     # Medium severity  
-    elif any(word in title for word in ["baustelle", "construction", "roadwork", "lane"]):
+    elif MEDIUM_SEVERITY_PATTERN.search(title):
         return "medium"
     # Low severity
     else:
         return "low"
 
-def remove_duplicate_incidents(incidents):
-    """Remove incidents that are very close to each other (likely duplicates)"""
-    unique_incidents = []
-    min_distance = 100  # 100 meters minimum distance
-    
-    for incident in incidents:
-        is_duplicate = False
-        for existing in unique_incidents:
-            if "local_x" in incident and "local_x" in existing:
+@njit(cache=True)
+def _dedup_mask(local_x, local_y, has_local, lat, lon, min_distance):
+    """Greedy duplicate detection over incidents sharing one title, returning a keep-mask"""
+    n = len(lat)
+    keep = np.ones(n, dtype=np.bool_)
+    min_d2 = min_distance * min_distance
+    min_term = haversine_threshold(min_distance / 1000)
+    for i in range(n):
+        for j in range(i):
+            if not keep[j]:
+                continue
+            if has_local[i] and has_local[j]:
                 # Calculate distance in local coordinates (more accurate)
-                dx = incident["local_x"] - existing["local_x"]
-                dy = incident["local_y"] - existing["local_y"]
-                distance = math.sqrt(dx*dx + dy*dy)
+                dx = local_x[i] - local_x[j]
+                dy = local_y[i] - local_y[j]
+                is_close = dx*dx + dy*dy < min_d2
             else:
                 # Fall back to GPS distance calculation
-                distance = haversine(incident["latitude"], incident["longitude"], 
-                                   existing["latitude"], existing["longitude"]) * 1000  # Convert to meters
-            
-            if distance < min_distance and incident["title"] == existing["title"]:
-                is_duplicate = True
+                is_close = haversine_term(lat[i], lon[i], lat[j], lon[j]) < min_term
+            if is_close:
+                keep[i] = False
                 break
+    return keep
+
+def _dedup_mask_kdtree(local_x, local_y, min_distance):
+    """Greedy duplicate detection over incidents sharing one title, using a KD-tree to find close pairs"""
+    n = len(local_x)
+    tree = cKDTree(np.column_stack([local_x, local_y]))
+    pairs = tree.query_pairs(r=min_distance, output_type='ndarray')
+    
+    # Earlier incidents that are strictly closer than min_distance
+    earlier_neighbours = [[] for _ in range(n)]
+    for i, j in pairs:
+        i, j = (i, j) if i > j else (j, i)
+        dx = local_x[i] - local_x[j]
+        dy = local_y[i] - local_y[j]
+        if dx*dx + dy*dy < min_distance * min_distance:
+            earlier_neighbours[i].append(j)
+    
+    keep = np.ones(n, dtype=np.bool_)
+    for i in range(n):
+        keep[i] = not any(keep[j] for j in earlier_neighbours[i])
+    return keep
+
+def remove_duplicate_incidents(incidents):
+    """Remove incidents that are very close to each other (likely duplicates)"""
+    if not incidents:
+        return []
+    min_distance = 100.0  # 100 meters minimum distance
+    
+    # Only incidents with the same title can be duplicates, so compare within title groups
+    title_groups = defaultdict(list)
+    for index, incident in enumerate(incidents):
+        title_groups[incident["title"]].append(index)
+    
+    keep = np.ones(len(incidents), dtype=np.bool_)
+    for indices in title_groups.values():
+        if len(indices) < 2:
+            continue
+        group = [incidents[i] for i in indices]
         
-        if not is_duplicate:
-            unique_incidents.append(incident)
+        # Pack the group into numeric arrays for the compiled kernel
+        has_local = np.array(["local_x" in inc for inc in group], dtype=np.bool_)
+        local_x = np.array([inc.get("local_x", 0.0) for inc in group], dtype=np.float64)
+        local_y = np.array([inc.get("local_y", 0.0) for inc in group], dtype=np.float64)
+        
+        if HAS_SCIPY and has_local.all():
+            keep[indices] = _dedup_mask_kdtree(local_x, local_y, min_distance)
+        else:
+            lat = np.array([inc["latitude"] for inc in group], dtype=np.float64)
+            lon = np.array([inc["longitude"] for inc in group], dtype=np.float64)
+            keep[indices] = _dedup_mask(local_x, local_y, has_local, lat, lon, min_distance)
+    
+    return [inc for inc, kept in zip(incidents, keep) if kept]
+
+def get_net_file_hash(chunk_size=1 << 20):
+    """SHA-1 of the network file, used to invalidate cached geometry when it changes"""
+    sha1 = hashlib.sha1()
+    with open(NET_FILE, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def load_cached_edge_centers(net_hash):
+    """Load previously computed edge centers for this network from disk"""
+    cache_file = EDGE_CENTERS_CACHE_FILE.format(net_hash)
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+    except Exception as e:
+        if VERBOSE:
+            print(f"Error reading edge center cache: {e}")
+        return {}
+
+def save_cached_edge_centers(net_hash, centers):
+    """Persist edge centers for this network to disk"""
+    cache_file = EDGE_CENTERS_CACHE_FILE.format(net_hash)
+    try:
+        with open(cache_file, 'wb') as f:
+            pickle.dump(centers, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        if VERBOSE:
+            print(f"Error writing edge center cache: {e}")
+
+def compute_edge_center(edge):
+    """Compute the center and length of a single edge through TraCI"""
+    # Get edge shape in local coordinates (SUMO's coordinate system)
+    lane_count = traci.edge.getLaneNumber(edge)
+    coords = []
+    
+    for i in range(lane_count):
+        lane_id = f"{edge}_{i}"
+        try:
+            shape = traci.lane.getShape(lane_id)
+            coords.extend(shape)
+        except:
+            continue
+    
+    if not coords:
+        try:
+            shape = traci.edge.getShape(edge)
+            coords = shape
+        except:
+            try:
+                from_junction = traci.edge.getFromJunction(edge)
+                to_junction = traci.edge.getToJunction(edge)
+                from_pos = traci.junction.getPosition(from_junction)
+                to_pos = traci.junction.getPosition(to_junction)
+                coords = [from_pos, to_pos]
+            except:
+                return None
+    
+    if not coords:
+        return None
+    
+    # Calculate center in local coordinates
+    avg_x = sum(p[0] for p in coords) / len(coords)
+    avg_y = sum(p[1] for p in coords) / len(coords)
+    
+    # Store with edge length for weighted detection
+    try:
+        edge_length = traci.edge.getLength(edge)
+    except:
+        edge_length = 100  # Default length
     
-    return unique_incidents
+    return {
+        "x": avg_x,
+        "y": avg_y,
+        "length": edge_length
+    }
+
+def build_edge_centers_from_net(net_file, route_edges):
+    """Compute edge centers and lengths by streaming the network file instead of querying TraCI"""
+    centers = {}
+    for event, elem in ET.iterparse(net_file, events=('end',)):
+        if elem.tag == 'edge' and elem.get('id') in route_edges:
+            xs, ys = [], []
+            edge_length = None
+            for lane in elem.findall('lane'):
+                for point in lane.get('shape', '').split():
+                    x, y = point.split(',')[:2]
+                    xs.append(float(x))
+                    ys.append(float(y))
+                if edge_length is None and lane.get('length') is not None:
+                    edge_length = float(lane.get('length'))
+            if xs:
+                centers[elem.get('id')] = {
+                    "x": sum(xs) / len(xs),
+                    "y": sum(ys) / len(ys),
+                    "length": edge_length if edge_length is not None else 100  # Default length
+                }
+        if elem.tag in ('edge', 'junction', 'connection'):
+            release_element(elem)
+    return centers
 
 def get_edge_centers_for_routes(routes):
     """Get edge centers with enhanced data for accurate distance calculation"""
@@ -457,111 +819,94 @@ def get_edge_centers_for_routes(routes):
     for vehicle_id, route_edges_list in routes.items():
         route_edges.update(route_edges_list)
     
-    centers = {}
-    for edge in route_edges:
-        try:
-            # Get edge shape in local coordinates (SUMO's coordinate system)
-            lane_count = traci.edge.getLaneNumber(edge)
-            coords = []
-            
-            for i in range(lane_count):
-                lane_id = f"{edge}_{i}"
-                try:
-                    shape = traci.lane.getShape(lane_id)
-                    coords.extend(shape)
-                except:
-                    continue
-            
-            if not coords:
-                try:
-                    shape = traci.edge.getShape(edge)
-                    coords = shape
-                except:
-                    try:
-                        from_junction = traci.edge.getFromJunction(edge)
-                        to_junction = traci.edge.getToJunction(edge)
-                        from_pos = traci.junction.getPosition(from_junction)
-                        to_pos = traci.junction.getPosition(to_junction)
-                        coords = [from_pos, to_pos]
-                    except:
-                        continue
-            
-            if coords:
-                # Calculate center in local coordinates
-                avg_x = sum(p[0] for p in coords) / len(coords)
-                avg_y = sum(p[1] for p in coords) / len(coords)
-                
-                # Store with edge length for weighted detection
-                try:
-                    edge_length = traci.edge.getLength(edge)
-                except:
-                    edge_length = 100  # Default length
-                
-                centers[edge] = {
-                    "x": avg_x,
-                    "y": avg_y,
-                    "length": edge_length
-                }
-        except Exception as e:
-            continue
+    # Reuse geometry computed in earlier runs on the same network file
+    net_hash = get_net_file_hash()
+    cached_centers = load_cached_edge_centers(net_hash)
+    centers = {edge: cached_centers[edge] for edge in route_edges if edge in cached_centers}
+    
+    missing_edges = route_edges - centers.keys()
+    if missing_edges and traci.isLoaded():
+        for edge in missing_edges:
+            try:
+                center = compute_edge_center(edge)
+            except Exception as e:
+                continue
+            if center is not None:
+                centers[edge] = center
+                cached_centers[edge] = center
+    elif missing_edges:
+        # No running simulation to query, read the geometry straight from the network file
+        net_centers = build_edge_centers_from_net(NET_FILE, missing_edges)
+        centers.update(net_centers)
+        cached_centers.update(net_centers)
+    
+    if len(centers) > len(route_edges) - len(missing_edges):
+        save_cached_edge_centers(net_hash, cached_centers)
     
     EDGE_CENTERS_CACHE = centers
+    if centers:
+        get_edge_index(centers)  # Build the spatial index now rather than at the first incident check
     print(f"Processed {len(centers):,} route segments for incident detection")
     return centers
 
+def fetch_incident_feed(url):
+    """Fetch one Autobahn service feed, returning None if the request fails"""
+    try:
+        return get_json_cached(url, INCIDENT_CACHE_TTL, timeout=5)
+    except requests.exceptions.RequestException:
+        return None
+
 def get_incidents(show_message=True):
     """Enhanced incident fetching with coordinate conversion and filtering"""
     incidents = []
-    transformer = create_coordinate_transformer()
+    lats, lons = [], []
     
     try:
         base_url = "https://verkehr.autobahn.de/o/autobahn"
         areas = ["A2", "A39"]
+        feeds = [(area, service, f"{base_url}/{area}/services/{service}")
+                 for area in areas for service in ["warning", "roadworks"]]
         
-        session = requests.Session()
-        for area in areas:
-            for service in ["warning", "roadworks"]:
-                url = f"{base_url}/{area}/services/{service}"
-                try:
-                    r = session.get(url, timeout=5)
-                    if r.status_code != 200:
-                        continue
-                    data = r.json()
-                    items = data.get(service, [])
+        # Fetch all feeds concurrently, results come back in feed order
+        with ThreadPoolExecutor(max_workers=len(feeds)) as executor:
+            responses = list(executor.map(fetch_incident_feed, [url for _, _, url in feeds]))
+        
+        for (area, service, url), data in zip(feeds, responses):
+            if data is None:
+                continue
+            items = data.get(service, [])
+            
+            for it in items:
+                coord = it.get("coordinate", {})
+                if "lat" in coord and "long" in coord:
+                    lat = float(coord["lat"])
+                    lon = float(coord["long"])
+                    lats.append(lat)
+                    lons.append(lon)
+                    
+                    # Create incident with enhanced data
+                    incident = {
+                        "id": f"{area}_{service}_{len(incidents)}",  # Unique ID
+                        "title": it.get("title", "").strip(),
+                        "latitude": lat,
+                        "longitude": lon,
+                        "type": service,
+                        "area": area,
+                        "severity": get_incident_severity(it),
+                        "timestamp": it.get("startTimestamp", ""),
+                        "location": f"{lat},{lon}"
+                    }
                     
-                    for it in items:
-                        coord = it.get("coordinate", {})
-                        if "lat" in coord and "long" in coord:
-                            lat = float(coord["lat"])
-                            lon = float(coord["long"])
-                            
-                            # Convert to local coordinates if possible
-                            local_x, local_y = convert_gps_to_local(lat, lon, transformer)
-                            
-                            # Create incident with enhanced data
-                            incident = {
-                                "id": f"{area}_{service}_{len(incidents)}",  # Unique ID
-                                "title": it.get("title", "").strip(),
-                                "latitude": lat,
-                                "longitude": lon,
-                                "type": service,
-                                "area": area,
-                                "severity": get_incident_severity(it),
-                                "timestamp": it.get("startTimestamp", ""),
-                                "location": f"{lat},{lon}"
-                            }
-                            
-                            # Add local coordinates if conversion was successful
-                            if local_x is not None and local_y is not None:
-                                incident["local_x"] = local_x
-                                incident["local_y"] = local_y
-                            
-                            incidents.append(incident)
-                            
-                except requests.exceptions.RequestException:
-                    continue
+                    incidents.append(incident)
         
-        session.close()
+        # Convert all incident positions to local coordinates in a single batch
+        xs, ys = convert_gps_batch_to_local(lats, lons, COORDINATE_TRANSFORMER)
+        if xs is not None:
+            for incident, local_x, local_y in zip(incidents, xs, ys):
+                # Add local coordinates if conversion was successful
+                if np.isfinite(local_x) and np.isfinite(local_y):
+                    incident["local_x"] = float(local_x)
+                    incident["local_y"] = float(local_y)
         
         # Remove duplicate incidents based on proximity
         incidents = remove_duplicate_incidents(incidents)
@@ -573,9 +918,40 @@ def get_incidents(show_message=True):
         print(f"Failed to get incidents: {e}")
     return incidents
 
+def build_edge_index(centers):
+    """Flatten edge centers into arrays and a KD-tree for vectorized incident matching"""
+    edge_ids = list(centers)
+    edge_x = np.fromiter((centers[e]["x"] for e in edge_ids), dtype=np.float64, count=len(edge_ids))
+    edge_y = np.fromiter((centers[e]["y"] for e in edge_ids), dtype=np.float64, count=len(edge_ids))
+    edge_len = np.fromiter((centers[e]["length"] for e in edge_ids), dtype=np.float64, count=len(edge_ids))
+    
+    # Adjust radius based on edge length (longer edges = larger detection radius)
+    length_bonus = np.minimum(edge_len * 0.1, 100)
+    
+    # Spatial index over edge centers to avoid testing every edge against every incident
+    edge_tree = cKDTree(np.column_stack([edge_x, edge_y])) if HAS_SCIPY else None
+    return edge_ids, edge_x, edge_y, length_bonus, edge_tree
+
+def get_edge_index(centers):
+    """Edge index for centers, rebuilt only when a different centers dict is passed in"""
+    global EDGE_INDEX_CACHE
+    if EDGE_INDEX_CACHE is None or EDGE_INDEX_CACHE[0] is not centers or len(EDGE_INDEX_CACHE[1][0]) != len(centers):
+        EDGE_INDEX_CACHE = (centers, build_edge_index(centers))
+    return EDGE_INDEX_CACHE[1]
+
 def get_affected_route_edges(incidents, centers, radius_km=1.0):
     """More accurate incident-to-edge mapping with dynamic radius and severity"""
     affected = {}  # Store edge and severity
+    if not incidents or not centers:
+        return affected
+    
+    # Edge arrays and KD-tree are built once per centers dict and reused across incident checks
+    edge_ids, edge_x, edge_y, length_bonus, edge_tree = get_edge_index(centers)
+    max_length_bonus = length_bonus.max()
+    all_edges = np.arange(len(edge_ids))
+    
+    # Highest severity weight seen per edge (0 = not affected)
+    edge_weight = np.zeros(len(edge_ids), dtype=np.int8)
     
     for incident in incidents:
         severity = incident["severity"]
@@ -592,42 +968,38 @@ def get_affected_route_edges(incidents, centers, radius_km=1.0):
         if "local_x" in incident and "local_y" in incident:
             incident_x = incident["local_x"]
             incident_y = incident["local_y"]
-            use_local_coords = True
+            if edge_tree is not None:
+                # Candidates within the largest possible radius, refined per edge below
+                candidates = np.asarray(edge_tree.query_ball_point((incident_x, incident_y), r=base_radius + max_length_bonus),
+                                        dtype=np.intp)
+            else:
+                candidates = all_edges
+            # Squared distance in local coordinates (meters) - more accurate
+            dynamic_radius = base_radius + length_bonus[candidates]
+            d2 = (incident_x - edge_x[candidates])**2 + (incident_y - edge_y[candidates])**2
+            hits = candidates[d2 <= dynamic_radius * dynamic_radius]
         else:
-            incident_lat = incident["latitude"]
-            incident_lon = incident["longitude"]
-            use_local_coords = False
+            # Fall back to GPS coordinates and haversine distance
+            # This is a simplified approach - ideally you'd convert edge coords to GPS
+            # For now, use a larger radius to compensate for coordinate system mismatch
+            term = haversine_term_array(incident["latitude"], incident["longitude"],
+                                        edge_x/111000, edge_y/111000)
+            hits = term <= haversine_threshold(base_radius * 2 / 1000)  # Double the radius for GPS fallback
         
-        for edge, edge_data in centers.items():
-            if use_local_coords:
-                # Calculate distance in local coordinates (meters) - more accurate
-                edge_x = edge_data["x"]
-                edge_y = edge_data["y"]
-                distance = math.sqrt((incident_x - edge_x)**2 + (incident_y - edge_y)**2)
-                
-                # Adjust radius based on edge length (longer edges = larger detection radius)
-                edge_length = edge_data["length"]
-                dynamic_radius = base_radius + min(edge_length * 0.1, 100)
-            else:
-                # Fall back to GPS coordinates and haversine distance
-                edge_x = edge_data["x"]
-                edge_y = edge_data["y"]
-                # This is a simplified approach - ideally you'd convert edge coords to GPS
-                # For now, use a larger radius to compensate for coordinate system mismatch
-                distance = haversine(incident_lat, incident_lon, edge_x/111000, edge_y/111000) * 1000
-                dynamic_radius = base_radius * 2  # Double the radius for GPS fallback
-            
-            if distance <= dynamic_radius:
-                # Store the most severe incident affecting this edge
-                if edge not in affected or get_severity_weight(severity) > get_severity_weight(affected[edge]):
-                    affected[edge] = severity
+        # Store the most severe incident affecting each edge
+        edge_weight[hits] = np.maximum(edge_weight[hits], get_severity_weight(severity))
+    
+    for i in np.flatnonzero(edge_weight):
+        affected[edge_ids[i]] = SEVERITY_BY_WEIGHT[int(edge_weight[i])]
     
     return affected
 
+SEVERITY_WEIGHTS = {"high": 3, "medium": 2, "low": 1}
+SEVERITY_BY_WEIGHT = {w: s for s, w in SEVERITY_WEIGHTS.items()}
+
 def get_severity_weight(severity):
     """Convert severity to numeric weight"""
-    weights = {"high": 3, "medium": 2, "low": 1}
-    return weights.get(severity, 1)
+    return SEVERITY_WEIGHTS.get(severity, 1)
 
 def write_weights_file(affected, filename="edge_weights.xml", penalty=100000):
     """Write edge weights with different penalties based on severity"""
@@ -640,27 +1012,23 @@ def write_weights_file(affected, filename="edge_weights.xml", penalty=100000):
         "low": 2000        # Minor delay
     }
     
-    root = ET.Element("meandata")
-    root.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
-    root.set("xsi:noNamespaceSchemaLocation", "http://sumo.dlr.de/xsd/meandata_file.xsd")
-    
-    interval = ET.SubElement(root, "interval")
-    interval.set("begin", "0")
-    interval.set("end", "3600")
-    
-    for edge, severity in affected.items():
-        edge_elem = ET.SubElement(interval, "edge")
-        edge_elem.set("id", edge)
-        edge_elem.set("traveltime", str(penalties[severity]))
-    
-    tree = ET.ElementTree(root)
-    tree.write(filename, encoding='utf-8', xml_declaration=True)
+    # Fixed schema, so write the XML directly instead of building and serializing a tree
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(f'<meandata xmlns:xsi="{XSI_NAMESPACE}" '
+                'xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/meandata_file.xsd">\n')
+        f.write('    <interval begin="0" end="3600">\n')
+        f.writelines(f'        <edge id={quoteattr(edge)} traveltime="{penalties[severity]}"/>\n'
+                     for edge, severity in affected.items())
+        f.write('    </interval>\n')
+        f.write('</meandata>\n')
 
-def compare_incidents_accurately(prev_incidents, new_incidents):
-    """More accurate incident comparison using IDs"""
-    prev_ids = {inc["id"] for inc in prev_incidents}
-    new_ids = {inc["id"] for inc in new_incidents}
-    
+def get_incident_ids(incidents):
+    """Snapshot the IDs of an incident list for later comparisons"""
+    return frozenset(inc["id"] for inc in incidents)
+
+def compare_incidents_accurately(prev_ids, new_ids):
+    """More accurate incident comparison using ID snapshots from get_incident_ids"""
     # Find truly new and resolved incidents
     new_incident_ids = new_ids - prev_ids
     resolved_incident_ids = prev_ids - new_ids
@@ -669,14 +1037,22 @@ def compare_incidents_accurately(prev_incidents, new_incidents):
 
 def reroute_if_needed(affected_edges):
     """Re-route with severity-based penalties"""
+    global LAST_AFFECTED_HASH
     if len(affected_edges) == 0:
         print("No route segments affected by incidents")
         return
     
+    # Routes were already computed for exactly this set of affected edges
+    affected_hash = hashlib.blake2b(repr(sorted(affected_edges.items())).encode(), digest_size=16).digest()
+    if affected_hash == LAST_AFFECTED_HASH:
+        print("Incident-affected segments unchanged, keeping current routes")
+        return
+    
     # Count incidents by severity
-    high_severity = sum(1 for s in affected_edges.values() if s == "high")
-    medium_severity = sum(1 for s in affected_edges.values() if s == "medium")
-    low_severity = sum(1 for s in affected_edges.values() if s == "low")
+    severity_counts = Counter(affected_edges.values())
+    high_severity = severity_counts["high"]
+    medium_severity = severity_counts["medium"]
+    low_severity = severity_counts["low"]
     
     print(f"Re-routing due to incidents: {high_severity} high, {medium_severity} medium, {low_severity} low severity")
     
@@ -696,12 +1072,15 @@ def reroute_if_needed(affected_edges):
     try:
         subprocess.run(cmd, check=True, capture_output=True, text=True)
         add_vehicle_type_with_friction_device()
+        LAST_AFFECTED_HASH = affected_hash
         print("Re-routing completed with severity-based penalties")
     except subprocess.CalledProcessError:
         print("Re-routing failed, keeping original routes")
+    invalidate_routes_cache()  # duarouter may have touched the routed file either way
 
 def run_simulation(main_vehicles, routes):
     traci.start(SUMO_CMD)
+    APPLIED_EDGE_FRICTION.clear()  # Fresh simulation, no friction applied yet
     
     # Add connection confirmation
     if not confirm_traci_connection():
@@ -709,11 +1088,15 @@ def run_simulation(main_vehicles, routes):
         return None
 
     # Initialize with current incidents to avoid false new incident counts
-    prev_incidents = get_incidents(show_message=False)  # Don't show message for initialization
+    prev_incident_ids = get_incident_ids(get_incidents(show_message=False))  # Don't show message for initialization
+    
+    data = {"times": None, "speeds": {}, "weather_log": []}
     
-    data = {"times": [], "speeds": {}, "weather_log": []}
-    for v in main_vehicles:
-        data["speeds"][v] = []
+    # Samples go into preallocated buffers sized for the configured horizon, doubled if a run outgrows them
+    capacity = int(SIMULATION_END / traci.simulation.getDeltaT()) + 1
+    times_buf = np.empty(capacity, dtype=np.float64)
+    speeds_buf = np.empty((len(main_vehicles), capacity), dtype=np.float64)
+    step_idx = 0
 
     ############################### Choose real or test friction mode here: ####################################
     #friction, weather_code, weather_name = get_diverse_friction_from_weather()
@@ -731,95 +1114,161 @@ def run_simulation(main_vehicles, routes):
     incident_check = 900           # Every 15 minutes (900 seconds) 
     prev_weather_code = weather_code
     last_weather_log_time = 0
+    next_weather_tick = weather_log_interval  # Next periodic weather status log
+    next_incident_tick = incident_check       # Next incident feed check
+    next_prefetch_tick = next_incident_tick - INCIDENT_PREFETCH_LEAD
+    next_due_tick = min(next_weather_tick, next_incident_tick, next_prefetch_tick)
+    
+    # Incident feeds are fetched on a worker thread so the HTTP round trips overlap simulation steps
+    incident_poller = ThreadPoolExecutor(max_workers=1)
+    pending_incidents = None
     
     # Record simulation start time for real-world time tracking
     sim_start_datetime = datetime.now()  # Real-world time when simulation starts
+    sim_start_ts = sim_start_datetime.timestamp()  # Epoch seconds for cheap formatting in the loop
     
     # Fetch minute-level weather forecast for next 3 hours
     weather_forecast_df = None
     if not USE_TEST_MODE:
         weather_forecast_df = fetch_minute_level_forecast()
         print(f"Loaded weather forecast for realistic weather changes")
+        
+        # Resolve the forecast to a per-second lookup once instead of filtering it every step
+        weather_row_by_second, weather_by_row = build_weather_schedule(weather_forecast_df, sim_start_datetime)
+        last_schedule_step = len(weather_row_by_second) - 1
     
     print(f"Starting simulation at real-world time: {sim_start_datetime.strftime('%H:%M:%S on %Y-%m-%d')}")
     print("Simulation timeline: Each simulation second = 1 real-world second")
 
-    while traci.simulation.getMinExpectedNumber() > 0:
-        traci.simulationStep()
-        t = traci.simulation.getTime()
-        data["times"].append(t)
-        vehicles = traci.vehicle.getIDList()
-        for v in main_vehicles:
-            speed = traci.vehicle.getSpeed(v) * 3.6 if v in vehicles else 0
-            data["speeds"][v].append(speed)
-
-        # CHECK WEATHER EVERY SIMULATION STEP (every second) for maximum precision
-        if not USE_TEST_MODE and weather_forecast_df is not None:
-            # Get current weather from forecast for this exact simulation time
-            friction2, wcode2, wname2 = get_weather_for_simulation_time(
-                weather_forecast_df, sim_start_datetime, t
-            )
+    # Subscriptions deliver the per-step values with the step itself instead of one query each
+    tc = traci.constants
+    traci.simulation.subscribe((tc.VAR_TIME, tc.VAR_DEPARTED_VEHICLES_IDS))
+    main_vehicle_set = frozenset(main_vehicles)
+    var_time, var_departed, var_speed = tc.VAR_TIME, tc.VAR_DEPARTED_VEHICLES_IDS, tc.VAR_SPEED
+    
+    # Bind the TraCI calls used in the loop once instead of resolving them on every use
+    min_expected_number = traci.simulation.getMinExpectedNumber
+    simulation_step = traci.simulationStep
+    get_sim_state = traci.simulation.getSubscriptionResults
+    get_vehicle_state = traci.vehicle.getAllSubscriptionResults
+    subscribe_vehicle = traci.vehicle.subscribe
+    get_vehicle_ids = traci.vehicle.getIDList
+    get_route = traci.vehicle.getRoute
+    reroute_vehicle = traci.vehicle.rerouteTraveltime
+
+    try:
+        while min_expected_number() > 0:
+            simulation_step()
+            sim_state = get_sim_state()
+            t = sim_state[var_time]
+            if step_idx == capacity:
+                times_buf = np.concatenate([times_buf, np.empty_like(times_buf)])
+                speeds_buf = np.concatenate([speeds_buf, np.empty_like(speeds_buf)], axis=1)
+                capacity *= 2
+            times_buf[step_idx] = t
+            for v in main_vehicle_set.intersection(sim_state[var_departed]):
+                subscribe_vehicle(v, (var_speed,))
+            # Vehicles drop out of the results once they have left the network
+            vehicle_state = get_vehicle_state()
+            for i, v in enumerate(main_vehicles):
+                state = vehicle_state.get(v)
+                speeds_buf[i, step_idx] = state[var_speed] * 3.6 if state else 0
+            step_idx += 1
+
+            # Periodic ticks fire once when simulation time reaches them; one comparison when none is due
+            weather_tick = incident_tick = False
+            if t + 1e-9 >= next_due_tick:
+                weather_tick = t + 1e-9 >= next_weather_tick
+                if weather_tick:
+                    next_weather_tick += weather_log_interval
+                incident_tick = t + 1e-9 >= next_incident_tick
+                if incident_tick:
+                    next_incident_tick += incident_check
+                    next_prefetch_tick = next_incident_tick - INCIDENT_PREFETCH_LEAD
+                elif pending_incidents is None and t + 1e-9 >= next_prefetch_tick:
+                    # Skip the fetch when the run ends before the tick it would serve
+                    if next_incident_tick <= SIMULATION_END:
+                        pending_incidents = incident_poller.submit(get_incidents, False)
+                    next_prefetch_tick = next_incident_tick
+                next_due_tick = min(next_weather_tick, next_incident_tick, next_prefetch_tick)
+
+            # CHECK WEATHER EVERY SIMULATION STEP (every second) for maximum precision
+            if not USE_TEST_MODE and weather_forecast_df is not None:
+                # Get current weather from forecast for this exact simulation time
+                step = min(int(t), last_schedule_step)
+                friction2, wcode2, wname2 = weather_by_row[weather_row_by_second[step]]
             
-            # Apply changes immediately when weather changes
-            if wcode2 != prev_weather_code:
-                current_routes = get_routes_from_file()
-                set_route_friction(current_routes, friction2)
-                data["weather_log"].append({"time": t, "weather": wname2, "friction": friction2})
-                prev_weather_code = wcode2
+                # Apply changes immediately when weather changes
+                if wcode2 != prev_weather_code:
+                    current_routes = get_routes_from_file()
+                    set_route_friction(current_routes, friction2)
+                    data["weather_log"].append({"time": t, "weather": wname2, "friction": friction2})
+                    prev_weather_code = wcode2
                 
-                # Calculate real-world time for immediate logging
-                real_time = sim_start_datetime + timedelta(seconds=t)
-                print(f"Weather changed at {t/60:.1f}min (real-time {real_time.strftime('%H:%M')}): {wname2} (friction: {friction2})")
-                last_weather_log_time = t
+                    # Calculate real-world time for immediate logging
+                    if SIM_LOGGER.isEnabledFor(logging.INFO):
+                        real_time = time.strftime('%H:%M', time.localtime(sim_start_ts + t))
+                        SIM_LOGGER.info("Weather changed at %.1fmin (real-time %s): %s (friction: %s)", t/60, real_time, wname2, friction2)
+                    last_weather_log_time = t
             
-            # Log status every 15 minutes even if no change
-            elif int(t) % weather_log_interval == 0 and int(t) > 0:
-                real_time = sim_start_datetime + timedelta(seconds=t)
-                print(f"Weather check: {wname2} (friction: {friction2})")
+                # Log status every 15 minutes even if no change
+                elif weather_tick:
+                    SIM_LOGGER.info("Weather check: %s (friction: %s)", wname2, friction2)
         
-        # Test mode - only log every 15 minutes
-        elif USE_TEST_MODE and int(t) % weather_log_interval == 0 and int(t) > 0:
-            new_friction, new_code, new_name = test_low_friction_scenario()
-            print(f"TEST MODE: Maintaining {new_name} (friction: {new_friction})")
-
-        # Check incidents every 15 minutes
-        if int(t) % incident_check == 0 and int(t) > 0:
-            new_incidents = get_incidents(show_message=False)  # Don't show message for updates
+            # Test mode - only log every 15 minutes
+            elif USE_TEST_MODE and weather_tick:
+                new_friction, new_code, new_name = test_low_friction_scenario()
+                SIM_LOGGER.info("TEST MODE: Maintaining %s (friction: %s)", new_name, new_friction)
+
+            # Check incidents every 15 minutes
+            if incident_tick:
+                if pending_incidents is not None:
+                    new_incidents = pending_incidents.result()  # Usually finished during the lead time
+                    pending_incidents = None
+                else:
+                    new_incidents = get_incidents(show_message=False)  # Don't show message for updates
             
-            # Accurate comparison using incident IDs
-            new_count, resolved_count = compare_incidents_accurately(prev_incidents, new_incidents)
+                # Accurate comparison using incident IDs
+                new_incident_ids = get_incident_ids(new_incidents)
+                new_count, resolved_count = compare_incidents_accurately(prev_incident_ids, new_incident_ids)
             
-            if new_count > 0 or resolved_count > 0:
-                print(f"Traffic update: +{new_count} new, -{resolved_count} resolved incidents")
+                if new_count > 0 or resolved_count > 0:
+                    SIM_LOGGER.info("Traffic update: +%d new, -%d resolved incidents", new_count, resolved_count)
                 
-                # Check if incidents affect current vehicles with accurate mapping
-                if EDGE_CENTERS_CACHE:
-                    affected_edges = get_affected_route_edges(new_incidents, EDGE_CENTERS_CACHE)
+                    # Check if incidents affect current vehicles with accurate mapping
+                    if EDGE_CENTERS_CACHE:
+                        affected_edges = get_affected_route_edges(new_incidents, EDGE_CENTERS_CACHE)
                     
-                    if affected_edges:
-                        rerouted_count = 0
-                        for v in vehicles:
-                            route = traci.vehicle.getRoute(v)
-                            if any(edge in affected_edges for edge in route):
-                                traci.vehicle.rerouteTraveltime(v)
-                                rerouted_count += 1
+                        if affected_edges:
+                            affected_set = frozenset(affected_edges)
+                            rerouted_count = 0
+                            for v in get_vehicle_ids():
+                                route = get_route(v)
+                                if not affected_set.isdisjoint(route):
+                                    reroute_vehicle(v)
+                                    rerouted_count += 1
                         
-                        high_count = sum(1 for s in affected_edges.values() if s == "high")
-                        medium_count = sum(1 for s in affected_edges.values() if s == "medium")
-                        low_count = sum(1 for s in affected_edges.values() if s == "low")
-                        print(f"Found {len(affected_edges)} affected route segments (high:{high_count}, medium:{medium_count}, low:{low_count})")
+                            severity_counts = Counter(affected_edges.values())
+                            high_count = severity_counts["high"]
+                            medium_count = severity_counts["medium"]
+                            low_count = severity_counts["low"]
+                            SIM_LOGGER.info("Found %d affected route segments (high:%d, medium:%d, low:%d)",
+                                            len(affected_edges), high_count, medium_count, low_count)
                         
-                        if rerouted_count > 0:
-                            print(f"Rerouted {rerouted_count} vehicles due to incidents")
+                            if rerouted_count > 0:
+                                SIM_LOGGER.info("Rerouted %d vehicles due to incidents", rerouted_count)
+                            else:
+                                SIM_LOGGER.info("Affected segments don't impact current vehicle routes")
                         else:
-                            print("Affected segments don't impact current vehicle routes")
-                    else:
-                        print("No incidents affecting current vehicle routes")
+                            SIM_LOGGER.info("No incidents affecting current vehicle routes")
                 
-                prev_incidents = new_incidents
-            else:
-                print("Traffic check: No new incident changes detected")
-
+                    prev_incident_ids = new_incident_ids
+                else:
+                    SIM_LOGGER.info("Traffic check: No new incident changes detected")
+    finally:
+        # Never leave the worker or a queued fetch behind, even if the loop raises
+        incident_poller.shutdown(wait=False, cancel_futures=True)
+    
     # Calculate simulation end time and real-world time correlation
     sim_end_datetime = datetime.now()
     final_sim_time = traci.simulation.getTime()
@@ -836,6 +1285,13 @@ def run_simulation(main_vehicles, routes):
     
     traci.close()
     
+    # Trim the buffers to the recorded steps; each vehicle gets a row view of the speed matrix
+    data["times"] = times_buf[:step_idx]
+    data["speeds"] = {v: speeds_buf[i, :step_idx] for i, v in enumerate(main_vehicles)}
+    # Decimated strided views of the same buffers for plotting
+    data["times_plot"] = times_buf[:step_idx:PLOT_DOWNSAMPLE]
+    data["speeds_plot"] = {v: speeds_buf[i, :step_idx:PLOT_DOWNSAMPLE] for i, v in enumerate(main_vehicles)}
+    
     # Return data with simulation start time for summary reporting
     data["sim_start_datetime"] = sim_start_datetime
     return data
@@ -844,17 +1300,28 @@ def generate_plot(data, vehicles):
     plt.style.use('default')
     fig, ax = plt.subplots(figsize=(12,7))
     colors = ['#1f77b4', '#ff7f0e']
+    # Use the decimated views from run_simulation when present, otherwise decimate here
+    times_plot = data.get("times_plot")
+    if times_plot is None:
+        times_plot = np.asarray(data["times"])[::PLOT_DOWNSAMPLE]
+    times_plot = np.asarray(times_plot, dtype=np.float32)
+    speeds_plot = data.get("speeds_plot", {})
     for idx, v in enumerate(vehicles):
         if v in data["speeds"]:
-            speeds = data["speeds"][v]
-            times = data["times"][:len(speeds)]
-            if max(speeds) > 0:
-                times_smooth = times[::10]
-                speeds_smooth = speeds[::10]
+            speeds = np.asarray(data["speeds"][v])
+            if len(speeds) and speeds.max() > 0:
+                speeds_smooth = speeds_plot[v] if v in speeds_plot else speeds[::PLOT_DOWNSAMPLE]
+                speeds_smooth = np.asarray(speeds_smooth, dtype=np.float32)
+                times_smooth = times_plot[:len(speeds_smooth)]
                 ax.plot(times_smooth, speeds_smooth, label=v, color=colors[idx % len(colors)], linewidth=0.8)
-    # Plot vertical lines for weather changes
-    for evt in data.get("weather_log", []):
-        ax.axvline(evt["time"], color='red', linestyle='--', alpha=0.5, linewidth=0.8)
+    # Plot vertical lines for weather changes as one collection spanning the full axes height
+    change_times = [evt["time"] for evt in data.get("weather_log", [])]
+    if change_times:
+        # x in data units, y in axes units; like axvline only the x data limits are extended
+        segments = [((x, 0), (x, 1)) for x in change_times]
+        ax.add_collection(LineCollection(segments, transform=ax.get_xaxis_transform(),
+                                         colors='red', linestyles='--', alpha=0.5, linewidth=0.8),
+                          autolim=True)
     ax.set_xlabel("Simulation Time (s)")
     ax.set_ylabel("Speed (km/h)")
     ax.set_title("Vehicle Speeds Over Time")
@@ -864,7 +1331,7 @@ def generate_plot(data, vehicles):
 
         # Save and print file location
     filename = "main_vehicle_speed_analysis.png"
-    plt.savefig(filename)
+    plt.savefig(filename, dpi=100, bbox_inches='tight')
     full_path = os.path.abspath(filename)
     print(f"Analysis plot saved: {full_path}")
 
@@ -877,7 +1344,8 @@ def print_simulation_summary(data, main_vehicles, incidents_count, sim_start_tim
     print("="*50)
     
     # Duration and time correlation
-    total_time = max(data["times"]) if data["times"] else 0
+    times = np.asarray(data["times"], dtype=np.float64)
+    total_time = float(times.max()) if times.size else 0
     print(f"Simulation duration: {int(total_time)}s ({total_time/60:.1f} minutes)")
     
     # Real-world time correlation if provided
@@ -889,9 +1357,9 @@ def print_simulation_summary(data, main_vehicles, incidents_count, sim_start_tim
     # Vehicle performance
     for vehicle in main_vehicles:
         if vehicle in data["speeds"]:
-            speeds = data["speeds"][vehicle]
-            avg_speed = sum(speeds) / len(speeds) if speeds else 0
-            max_speed = max(speeds) if speeds else 0
+            speeds = np.asarray(data["speeds"][vehicle], dtype=np.float64)
+            avg_speed = float(speeds.mean()) if speeds.size else 0
+            max_speed = float(speeds.max()) if speeds.size else 0
             print(f"{vehicle}: Avg {avg_speed:.1f} km/h, Max {max_speed:.1f} km/h")
     
     # Weather changes
@@ -928,20 +1396,9 @@ if __name__=="__main__":
         routes = get_routes_from_file()
         print(f"Routes established for {len(routes)} vehicles")
         
-        # Step 3: Start SUMO temporarily to get route edge centers
-        temp_cmd = [os.path.join(sumo_bin_path, "sumo"), "-c", SUMO_CONFIG_FILE, 
-                   "--no-step-log", "--no-warnings"]
-        print("Connecting to SUMO for route analysis...")
-        traci.start(temp_cmd)
-        
-        # Add connection confirmation
-        if not confirm_traci_connection():
-            print("Error: Could not establish temporary TraCI connection")
-            sys.exit(1)
-            
+        # Step 3: Get route edge centers from the network file
+        print("Reading route geometry from network file...")
         centers = get_edge_centers_for_routes(routes)
-        traci.close()
-        print("Temporary SUMO session completed successfully")
         
         # Step 4: Check incidents against routes
         print("Checking traffic incidents against routes...")
@@ -950,9 +1407,10 @@ if __name__=="__main__":
         
         # Step 5: Re-route if needed
         if affected_edges:
-            high_count = sum(1 for s in affected_edges.values() if s == "high")
-            medium_count = sum(1 for s in affected_edges.values() if s == "medium") 
-            low_count = sum(1 for s in affected_edges.values() if s == "low")
+            severity_counts = Counter(affected_edges.values())
+            high_count = severity_counts["high"]
+            medium_count = severity_counts["medium"]
+            low_count = severity_counts["low"]
             print(f"Found {len(affected_edges)} affected route segments (high:{high_count}, medium:{medium_count}, low:{low_count})")
             reroute_if_needed(affected_edges)
             routes = get_routes_from_file()  # Get updated routes